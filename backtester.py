@@ -2,32 +2,221 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from typing import List, Dict
-from indicators import TechnicalIndicators
+from typing import List, Dict, Tuple
+from indicators import TechnicalIndicators, DTYPE
+from utils import TradeBook
+from _njit import njit, prange
+
+# Position sides used by _simulate
+FLAT, LONG, SHORT = 0, 1, -1
+
+# Metrics returned per parameter set by Backtester.sweep
+SWEEP_COLUMNS = ('total_trades', 'win_rate', 'final_balance', 'max_drawdown', 'sharpe_ratio')
+
+
+@njit(cache=True)
+def _simulate(close: np.ndarray, long_entries: np.ndarray, short_entries: np.ndarray,
+              stop_loss: float, profit_target: float, balance: float,
+              entry_idx: np.ndarray, exit_idx: np.ndarray, side: np.ndarray,
+              profit: np.ndarray, balance_before: np.ndarray,
+              balance_after: np.ndarray) -> Tuple[int, int, int]:
+    """
+    Walk the bars once holding at most one full-balance position, writing
+    each closed trade into the preallocated arrays.
+    Returns (trade count, side of the position left open, its entry bar)
+    """
+    n_trades = 0
+    pos_side = FLAT
+    entry_bar = 0
+    entry_price = 0.0
+    stop_price = target_price = 0.0
+    size = 0.0
+    
+    for i in range(close.shape[0] - 1):
+        price = np.float64(close[i])
+        
+        # Check for entry signals
+        if pos_side == FLAT:
+            if long_entries[i]:
+                pos_side = LONG
+            elif short_entries[i]:
+                pos_side = SHORT
+            else:
+                continue
+            entry_bar = i
+            entry_price = price
+            size = balance / price
+            
+            # Exit levels are fixed at entry
+            if pos_side == LONG:
+                stop_price = entry_price * (1 - stop_loss)
+                target_price = entry_price * (1 + profit_target)
+            else:
+                stop_price = entry_price * (1 + stop_loss)
+                target_price = entry_price * (1 - profit_target)
+            continue
+        
+        # Check stop loss and take profit
+        if pos_side == LONG:
+            hit = price <= stop_price or price >= target_price
+        else:
+            hit = price >= stop_price or price <= target_price
+        
+        if hit:
+            pnl = (price - entry_price) * size * pos_side
+            entry_idx[n_trades] = entry_bar
+            exit_idx[n_trades] = i
+            side[n_trades] = pos_side
+            profit[n_trades] = pnl
+            balance_before[n_trades] = balance
+            balance += pnl
+            balance_after[n_trades] = balance
+            n_trades += 1
+            pos_side = FLAT
+    
+    return n_trades, pos_side, entry_bar
+
+
+@njit(cache=True, nogil=True)
+def _simulate_and_metrics(close: np.ndarray, long_base: np.ndarray, short_base: np.ndarray,
+                          trend_strength: np.ndarray, stop_loss: float, profit_target: float,
+                          min_trend_strength: float, balance: float, out: np.ndarray):
+    """Run one backtest and write its SWEEP_COLUMNS metrics into out"""
+    strong_trend = trend_strength > min_trend_strength
+    max_trades = close.shape[0] // 2 + 1
+    entry_idx = np.empty(max_trades, np.int64)
+    exit_idx = np.empty(max_trades, np.int64)
+    side = np.empty(max_trades, np.int8)
+    profit = np.empty(max_trades)
+    balance_before = np.empty(max_trades)
+    balance_after = np.empty(max_trades)
+    
+    n_trades, _, _ = _simulate(
+        close, long_base & strong_trend, short_base & strong_trend,
+        stop_loss, profit_target, balance,
+        entry_idx, exit_idx, side, profit, balance_before, balance_after
+    )
+    
+    out[0] = n_trades
+    if n_trades == 0:
+        out[1] = 0.0
+        out[2] = balance
+        out[3] = 0.0
+        out[4] = 0.0
+        return
+    
+    wins = 0
+    peak = balance_after[0]
+    max_drawdown = 0.0
+    for j in range(n_trades):
+        if profit[j] > 0:
+            wins += 1
+        if balance_after[j] > peak:
+            peak = balance_after[j]
+        drawdown = (peak - balance_after[j]) / peak
+        if drawdown > max_drawdown:
+            max_drawdown = drawdown
+    
+    returns = profit[:n_trades] / balance_before[:n_trades]
+    out[1] = wins / n_trades
+    out[2] = balance_after[n_trades - 1]
+    out[3] = max_drawdown
+    out[4] = returns.mean() / (returns.std() + 1e-10) * np.sqrt(252)
+
+
+@njit(cache=True, parallel=True)
+def _sweep(close: np.ndarray, long_base: np.ndarray, short_base: np.ndarray,
+           trend_strength: np.ndarray, params: np.ndarray, balance: float, out: np.ndarray):
+    """Run _simulate_and_metrics for every (stop_loss, profit_target, min_trend_strength) row"""
+    for p in prange(params.shape[0]):
+        _simulate_and_metrics(close, long_base, short_base, trend_strength,
+                              params[p, 0], params[p, 1], params[p, 2], balance, out[p])
+
 
 class Backtester:
+    _TRADE_ARRAYS = ('_entry_idx', '_exit_idx', '_side', '_profit', '_bal_before', '_bal_after')
+
     def __init__(self, df: pd.DataFrame, initial_balance: float = 10000):
         self.df = df
         self.balance = initial_balance
         self.positions: List[Dict] = []
-        self.trades_history: List[Dict] = []
         self.indicators = TechnicalIndicators()
+        
+        # Closed trades stored column-wise; only the first _n_trades entries are valid
+        self._entry_idx = np.empty(len(df), np.int64)
+        self._exit_idx = np.empty(len(df), np.int64)
+        self._side = np.empty(len(df), np.int8)
+        self._profit = np.empty(len(df))
+        self._bal_before = np.empty(len(df))
+        self._bal_after = np.empty(len(df))
+        self._n_trades = 0
+        
+        self._precompute()
+
+    def _reserve(self, extra: int):
+        """Grow the trade arrays so that `extra` more trades fit"""
+        needed = self._n_trades + extra
+        if needed <= self._profit.shape[0]:
+            return
+        for name in self._TRADE_ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(max(needed, 2 * old.shape[0]), old.dtype)
+            new[:self._n_trades] = old[:self._n_trades]
+            setattr(self, name, new)
+
+    @property
+    def trades_history(self) -> List[Dict]:
+        """Closed trades as records, built from the trade arrays"""
+        index = self.df.index
+        return [{
+            'side': 'long' if self._side[j] == LONG else 'short',
+            'entry_time': index[self._entry_idx[j]],
+            'exit_time': index[self._exit_idx[j]],
+            'entry_price': self.close_arr[self._entry_idx[j]],
+            'exit_price': self.close_arr[self._exit_idx[j]],
+            'profit': self._profit[j],
+            'balance_before': self._bal_before[j],
+            'balance_after': self._bal_after[j]
+        } for j in range(self._n_trades)]
+
+    @property
+    def trade_book(self) -> TradeBook:
+        """Closed trades as a TradeBook, copied column-wise from the trade arrays"""
+        index = self.df.index
+        if not isinstance(index, pd.DatetimeIndex):
+            raise TypeError("trade_book needs a DatetimeIndex on the price data; use trades_history instead")
+        
+        n = self._n_trades
+        entry_idx, exit_idx = self._entry_idx[:n], self._exit_idx[:n]
+        bar_ns = index.to_numpy('datetime64[ns]').view(np.int64)
+        return TradeBook.from_columns(
+            self._side[:n], bar_ns[entry_idx], bar_ns[exit_idx], self._profit[:n], tz=index.tz,
+            entry_price=self.close_arr[entry_idx], exit_price=self.close_arr[exit_idx],
+            balance_before=self._bal_before[:n], balance_after=self._bal_after[:n]
+        )
+
+    def _precompute(self):
+        """Compute every indicator once over the full history"""
+        high = self.df['high'].to_numpy(DTYPE)
+        low = self.df['low'].to_numpy(DTYPE)
+        self.close_arr = self.df['close'].to_numpy(DTYPE)
+        
+        (self.K, self.D, self.ts_arr, self.rsi_arr,
+         self.ma_arr, self.ubb_arr, self.lbb_arr) = self.indicators.calculate_all_arrays(high, low, self.close_arr)
 
     def calculate_metrics(self) -> Dict:
         """Calculate trading metrics from backtest results"""
-        if not self.trades_history:
+        if not self._n_trades:
             return {}
 
-        profits = [trade['profit'] for trade in self.trades_history]
-        winning_trades = [p for p in profits if p > 0]
-        losing_trades = [p for p in profits if p < 0]
-
+        profits = self._profit[:self._n_trades]
+        
         metrics = {
-            'total_trades': len(self.trades_history),
-            'winning_trades': len(winning_trades),
-            'losing_trades': len(losing_trades),
-            'win_rate': len(winning_trades) / len(self.trades_history) if self.trades_history else 0,
-            'average_profit': np.mean(profits) if profits else 0,
+            'total_trades': self._n_trades,
+            'winning_trades': int((profits > 0).sum()),
+            'losing_trades': int((profits < 0).sum()),
+            'win_rate': (profits > 0).mean(),
+            'average_profit': profits.mean(),
             'max_drawdown': self.calculate_max_drawdown(),
             'sharpe_ratio': self.calculate_sharpe_ratio(),
             'final_balance': self.balance
@@ -36,94 +225,75 @@ class Backtester:
 
     def calculate_max_drawdown(self) -> float:
         """Calculate maximum drawdown"""
-        balance_history = [trade['balance_after'] for trade in self.trades_history]
-        peak = balance_history[0]
-        max_drawdown = 0
-        
-        for balance in balance_history:
-            if balance > peak:
-                peak = balance
-            drawdown = (peak - balance) / peak
-            max_drawdown = max(max_drawdown, drawdown)
-        
-        return max_drawdown
+        balance_history = self._bal_after[:self._n_trades]
+        peak = np.maximum.accumulate(balance_history)
+        return ((peak - balance_history) / peak).max()
 
     def calculate_sharpe_ratio(self) -> float:
         """Calculate Sharpe Ratio"""
-        if not self.trades_history:
+        if not self._n_trades:
             return 0
             
-        returns = [trade['profit']/trade['balance_before'] for trade in self.trades_history]
-        if not returns:
-            return 0
-            
-        return np.mean(returns) / (np.std(returns) + 1e-10) * np.sqrt(252)
+        returns = self._profit[:self._n_trades] / self._bal_before[:self._n_trades]
+        return returns.mean() / (returns.std() + 1e-10) * np.sqrt(252)
 
     def run_backtest(self, strategy_config: Dict) -> Dict:
         """Run backtest with given strategy configuration"""
-        for i in range(len(self.df)-1):
-            current_data = self.df.iloc[:i+1]
-            
-            # Calculate indicators
-            k, d, trend_strength = self.indicators.calculate_KDJ(current_data)
-            rsi = self.indicators.calculate_RSI(current_data)
-            ma, upper_bb, lower_bb = self.indicators.calculate_bollinger_bands(current_data)
-            support, resistance = self.indicators.calculate_support_resistance(current_data)
-            
-            # Check for entry signals
-            if not self.positions:  # No open positions
-                if self.check_entry_signal(k, d, rsi, current_data['close'].iloc[-1], 
-                                        ma, upper_bb, lower_bb, trend_strength, strategy_config):
-                    self.open_position(current_data, strategy_config)
-            
-            # Check for exit signals
-            else:
-                if self.check_exit_signal(self.positions[-1], current_data, strategy_config):
-                    self.close_position(current_data)
+        long_entries, short_entries = self._compute_signals(strategy_config)
+        
+        # A trade needs at least an entry bar and a later exit bar
+        self._reserve(len(self.df) // 2 + 1)
+        start = self._n_trades
+        
+        n_trades, open_side, open_idx = _simulate(
+            self.close_arr, long_entries, short_entries,
+            strategy_config['stop_loss'], strategy_config['profit_target'], self.balance,
+            self._entry_idx[start:], self._exit_idx[start:], self._side[start:],
+            self._profit[start:], self._bal_before[start:], self._bal_after[start:]
+        )
+        self._n_trades += n_trades
+        if n_trades:
+            self.balance = self._bal_after[self._n_trades - 1]
+        
+        # Position still open after the last bar
+        if open_side != FLAT:
+            self.positions.append({
+                'side': 'long' if open_side == LONG else 'short',
+                'entry_price': self.close_arr[open_idx],
+                'entry_time': self.df.index[open_idx],
+                'size': self.balance / self.close_arr[open_idx]
+            })
         
         return self.calculate_metrics()
 
-    def check_entry_signal(self, k: float, d: float, rsi: float, price: float, 
-                          ma: float, upper_bb: float, lower_bb: float, 
-                          trend_strength: float, config: Dict) -> bool:
-        """Check entry conditions"""
-        # Long entry conditions
-        if (k > d and  # KDJ crossover
-            rsi < 30 and  # Oversold RSI
-            price > ma and  # Price above MA
-            trend_strength > config['min_trend_strength'] and  # Strong trend
-            price < lower_bb):  # Price below lower BB
-            return True
-            
-        # Short entry conditions
-        if (k < d and  # KDJ crossunder
-            rsi > 70 and  # Overbought RSI
-            price < ma and  # Price below MA
-            trend_strength > config['min_trend_strength'] and  # Strong trend
-            price > upper_bb):  # Price above upper BB
-            return True
-            
-        return False
+    def _compute_signals(self, config: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute long and short entry masks for every bar"""
+        long_base, short_base = self._base_signals()
+        strong_trend = self.ts_arr > config['min_trend_strength']
+        return long_base & strong_trend, short_base & strong_trend
 
-    def check_exit_signal(self, position: Dict, current_data: pd.DataFrame, config: Dict) -> bool:
-        """Check exit conditions"""
-        current_price = current_data['close'].iloc[-1]
-        entry_price = position['entry_price']
+    def _base_signals(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute the entry conditions that do not depend on the strategy config"""
+        close = self.close_arr
         
-        # Check stop loss
-        if position['side'] == 'long':
-            if current_price <= entry_price * (1 - config['stop_loss']):
-                return True
-        else:
-            if current_price >= entry_price * (1 + config['stop_loss']):
-                return True
-                
-        # Check take profit
-        if position['side'] == 'long':
-            if current_price >= entry_price * (1 + config['profit_target']):
-                return True
-        else:
-            if current_price <= entry_price * (1 - config['profit_target']):
-                return True
-                
-        return False
+        # Long entry conditions: KDJ crossover, oversold RSI, price above MA but below lower BB
+        long_base = ((self.K > self.D) & (self.rsi_arr < 30) & (close > self.ma_arr) &
+                     (close < self.lbb_arr))
+        
+        # Short entry conditions: KDJ crossunder, overbought RSI, price below MA but above upper BB
+        short_base = ((self.K < self.D) & (self.rsi_arr > 70) & (close < self.ma_arr) &
+                      (close > self.ubb_arr))
+        
+        return long_base, short_base
+
+    def sweep(self, param_grid: np.ndarray) -> np.ndarray:
+        """
+        Backtest every (stop_loss, profit_target, min_trend_strength) row of
+        param_grid in parallel from the current balance, without recording trades.
+        Returns one row of SWEEP_COLUMNS metrics per parameter set
+        """
+        params = np.ascontiguousarray(param_grid, dtype=np.float64).reshape(-1, 3)
+        long_base, short_base = self._base_signals()
+        out = np.empty((params.shape[0], len(SWEEP_COLUMNS)))
+        _sweep(self.close_arr, long_base, short_base, self.ts_arr, params, float(self.balance), out)
+        return out
@@ -7,6 +7,7 @@ class Config:
     SYMBOL = "BTCUSDT"
     TIMEFRAME = "1m"
     LEVERAGE = 5
+    MAX_LOOKBACK = 1440  # klines kept in memory for indicators (1 day of 1m bars)
     RISK_PERCENTAGE = 0.02  # 2% risk per trade
     
     # Use Testnet
@@ -1,52 +1,295 @@
 # indicators.py
+# Contract: the *_array(s) indicators take and return DTYPE (float32) arrays. That is ample
+# for prices and 0-100 oscillators and halves memory traffic; running sums and averages
+# are still accumulated in float64 internally.
 import pandas as pd
 import numpy as np
 from typing import Tuple, Dict
+from _njit import njit
+
+try:
+    import bottleneck as bn
+except ImportError:
+    bn = None
+
+try:
+    import talib
+except ImportError:
+    talib = None
+
+DTYPE = np.float32
+
+
+@njit(cache=True)
+def _kdj_loop(rsv: np.ndarray, K: np.ndarray, D: np.ndarray):
+    """Smooth RSV into K and D in place"""
+    if rsv.shape[0] == 0:
+        return
+    K[0] = 50.0
+    D[0] = 50.0
+    for i in range(1, rsv.shape[0]):
+        K[i] = (2.0/3.0) * K[i-1] + (1.0/3.0) * rsv[i]
+        D[i] = (2.0/3.0) * D[i-1] + (1.0/3.0) * K[i]
+
+
+@njit(cache=True)
+def _wilder_rsi(close: np.ndarray, period: int, out: np.ndarray):
+    """Fill out[period:] with Wilder-smoothed RSI, leaving the warm-up bars untouched"""
+    n = close.shape[0]
+    if n <= period:
+        return
+    
+    # Seed the averages with a simple mean over the first period of changes
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, period + 1):
+        change = np.float64(close[i]) - np.float64(close[i-1])
+        if change > 0:
+            avg_gain += change
+        else:
+            avg_loss -= change
+    avg_gain /= period
+    avg_loss /= period
+    
+    for i in range(period, n):
+        if i > period:
+            change = np.float64(close[i]) - np.float64(close[i-1])
+            gain = change if change > 0 else 0.0
+            loss = -change if change < 0 else 0.0
+            avg_gain = (avg_gain * (period - 1) + gain) / period
+            avg_loss = (avg_loss * (period - 1) + loss) / period
+        
+        total = avg_gain + avg_loss
+        out[i] = 100.0 * avg_gain / total if total > 0 else np.nan
+
+
+@njit(cache=True)
+def _compute_all(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                 kdj_period: int, rsi_period: int, bb_period: int, bb_std: float,
+                 out_k: np.ndarray, out_d: np.ndarray, out_ts: np.ndarray, out_rsi: np.ndarray,
+                 out_ma: np.ndarray, out_ubb: np.ndarray, out_lbb: np.ndarray):
+    """
+    Single pass over the bars producing the same values as calculate_KDJ_arrays,
+    calculate_RSI_array and calculate_bollinger_bands_arrays, written into the
+    preallocated output arrays
+    """
+    n = close.shape[0]
+    if n == 0:
+        return
+    
+    # Monotonic deques of bar indices for the rolling highest high / lowest low
+    max_q = np.empty(n, np.int64)
+    min_q = np.empty(n, np.int64)
+    max_head = max_tail = min_head = min_tail = 0
+    
+    k_prev = d_prev = 50.0
+    j_window = np.empty(5)
+    avg_gain = avg_loss = 0.0
+    
+    # Bollinger sums are taken relative to the first close to limit cancellation
+    shift = np.float64(close[0])
+    bb_sum = bb_sumsq = 0.0
+    
+    for i in range(n):
+        # Rolling extremes over kdj_period bars, defined from the first bar
+        while max_tail > max_head and high[max_q[max_tail - 1]] <= high[i]:
+            max_tail -= 1
+        max_q[max_tail] = i
+        max_tail += 1
+        if max_q[max_head] <= i - kdj_period:
+            max_head += 1
+        
+        while min_tail > min_head and low[min_q[min_tail - 1]] >= low[i]:
+            min_tail -= 1
+        min_q[min_tail] = i
+        min_tail += 1
+        if min_q[min_head] <= i - kdj_period:
+            min_head += 1
+        
+        # KDJ
+        if i == 0:
+            k = d = 50.0
+        else:
+            lowest = np.float64(low[min_q[min_head]])
+            price_range = np.float64(high[max_q[max_head]]) - lowest
+            rsv = (np.float64(close[i]) - lowest) / price_range * 100.0 if price_range != 0 else 50.0
+            k = (2.0/3.0) * k_prev + (1.0/3.0) * rsv
+            d = (2.0/3.0) * d_prev + (1.0/3.0) * k
+        out_k[i] = k
+        out_d[i] = d
+        k_prev = k
+        d_prev = d
+        
+        # Trend strength from the sample std of the last five J values
+        j_window[i % 5] = 3.0 * k - 2.0 * d
+        if i >= 4:
+            j_mean = j_window.sum() / 5.0
+            j_var = ((j_window - j_mean) ** 2).sum() / 4.0
+            out_ts[i] = abs(k - d) / (0.1 + np.sqrt(j_var))
+        else:
+            out_ts[i] = np.nan
+        
+        # Wilder RSI, seeded with the mean of the first rsi_period changes
+        if i >= 1:
+            change = np.float64(close[i]) - np.float64(close[i-1])
+            gain = change if change > 0 else 0.0
+            loss = -change if change < 0 else 0.0
+            if i <= rsi_period:
+                avg_gain += gain
+                avg_loss += loss
+                if i == rsi_period:
+                    avg_gain /= rsi_period
+                    avg_loss /= rsi_period
+            else:
+                avg_gain = (avg_gain * (rsi_period - 1) + gain) / rsi_period
+                avg_loss = (avg_loss * (rsi_period - 1) + loss) / rsi_period
+        if i >= rsi_period:
+            total = avg_gain + avg_loss
+            out_rsi[i] = 100.0 * avg_gain / total if total > 0 else np.nan
+        else:
+            out_rsi[i] = np.nan
+        
+        # Bollinger Bands from O(1) rolling sum / sum of squares
+        x = np.float64(close[i]) - shift
+        bb_sum += x
+        bb_sumsq += x * x
+        if i >= bb_period:
+            y = np.float64(close[i - bb_period]) - shift
+            bb_sum -= y
+            bb_sumsq -= y * y
+        if i >= bb_period - 1:
+            mean = bb_sum / bb_period
+            var = (bb_sumsq - bb_sum * mean) / (bb_period - 1)
+            std_dev = np.sqrt(var) if var > 0 else 0.0
+            ma = mean + shift
+            out_ma[i] = ma
+            out_ubb[i] = ma + std_dev * bb_std
+            out_lbb[i] = ma - std_dev * bb_std
+        else:
+            out_ma[i] = out_ubb[i] = out_lbb[i] = np.nan
+
+
+def _rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    """Rolling minimum that is defined from the first bar (min_periods=1)"""
+    if bn is not None and values.shape[0]:
+        # bottleneck rejects windows longer than the data; those are just expanding windows
+        return bn.move_min(values, window=min(window, values.shape[0]), min_count=1)
+    if talib is not None:
+        out = talib.MIN(values.astype(np.float64), timeperiod=window).astype(values.dtype)
+        head = min(window - 1, values.shape[0])
+        out[:head] = np.minimum.accumulate(values[:head])
+        return out
+    return pd.Series(values).rolling(window=window, min_periods=1).min().to_numpy(values.dtype)
+
+
+def _rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """Rolling maximum that is defined from the first bar (min_periods=1)"""
+    if bn is not None and values.shape[0]:
+        # bottleneck rejects windows longer than the data; those are just expanding windows
+        return bn.move_max(values, window=min(window, values.shape[0]), min_count=1)
+    if talib is not None:
+        out = talib.MAX(values.astype(np.float64), timeperiod=window).astype(values.dtype)
+        head = min(window - 1, values.shape[0])
+        out[:head] = np.maximum.accumulate(values[:head])
+        return out
+    return pd.Series(values).rolling(window=window, min_periods=1).max().to_numpy(values.dtype)
+
 
 class TechnicalIndicators:
     @staticmethod
-    def calculate_KDJ(df: pd.DataFrame, n: int = 9, m1: int = 3, m2: int = 3) -> Tuple[float, float, float]:
-        """Calculate KDJ indicator with trend strength"""
-        high = df['high']
-        low = df['low']
-        close = df['close']
+    def calculate_KDJ_arrays(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                             n: int = 9, m1: int = 3, m2: int = 3) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Calculate full-length K, D and trend strength arrays"""
+        high = np.ascontiguousarray(high, dtype=DTYPE)
+        low = np.ascontiguousarray(low, dtype=DTYPE)
+        close = np.ascontiguousarray(close, dtype=DTYPE)
         
-        lowest_low = low.rolling(window=n, min_periods=1).min()
-        highest_high = high.rolling(window=n, min_periods=1).max()
-        rsv = (close - lowest_low) / (highest_high - lowest_low) * 100
+        lowest_low = _rolling_min(low, n)
+        highest_high = _rolling_max(high, n)
+        # A flat window has no range; treat it as mid-range rather than letting NaN poison K/D
+        price_range = highest_high - lowest_low
+        flat = price_range == 0
+        rsv = np.where(flat, 50.0, (close - lowest_low) / np.where(flat, 1.0, price_range) * 100).astype(DTYPE)
         
-        K = pd.Series(index=rsv.index)
-        D = pd.Series(index=rsv.index)
-        K.iloc[0] = 50
-        D.iloc[0] = 50
-        
-        for i in range(1, len(rsv)):
-            K.iloc[i] = (2/3) * K.iloc[i-1] + (1/3) * rsv.iloc[i]
-            D.iloc[i] = (2/3) * D.iloc[i-1] + (1/3) * K.iloc[i]
+        K = np.empty_like(rsv)
+        D = np.empty_like(rsv)
+        _kdj_loop(rsv, K, D)
         
         J = 3 * K - 2 * D
-        trend_strength = abs(K - D) / (0.1 + J.rolling(5).std())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend_strength = np.abs(K - D) / (0.1 + pd.Series(J).rolling(5).std().to_numpy())
+        
+        return K, D, trend_strength.astype(DTYPE)
+
+    @staticmethod
+    def calculate_KDJ(df: pd.DataFrame, n: int = 9, m1: int = 3, m2: int = 3) -> Tuple[float, float, float]:
+        """Calculate KDJ indicator with trend strength"""
+        K, D, trend_strength = TechnicalIndicators.calculate_KDJ_arrays(
+            df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), n, m1, m2
+        )
+        return K[-1], D[-1], trend_strength[-1]
+
+    @staticmethod
+    def calculate_RSI_array(close: np.ndarray, period: int = 14) -> np.ndarray:
+        """Calculate full-length RSI array using Wilder's smoothing"""
+        close = np.ascontiguousarray(close, dtype=DTYPE)
+        if talib is not None:
+            rsi = talib.RSI(close.astype(np.float64), timeperiod=period)
+            # talib reports 0 until the price first moves; match the kernels' NaN
+            moved = np.logical_or.accumulate(np.diff(close) != 0)
+            rsi[1:][~moved] = np.nan
+            return rsi.astype(DTYPE)
         
-        return K.iloc[-1], D.iloc[-1], trend_strength.iloc[-1]
+        out = np.full(close.shape[0], np.nan, DTYPE)
+        _wilder_rsi(close, period, out)
+        return out
 
     @staticmethod
     def calculate_RSI(df: pd.DataFrame, period: int = 14) -> float:
         """Calculate RSI indicator"""
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        return rsi.iloc[-1]
+        return TechnicalIndicators.calculate_RSI_array(df['close'].to_numpy(), period)[-1]
+
+    @staticmethod
+    def calculate_bollinger_bands_arrays(close: np.ndarray, period: int = 20,
+                                         std: int = 2) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Calculate full-length Bollinger Bands arrays (sample standard deviation)"""
+        close = np.ascontiguousarray(close, dtype=DTYPE)
+        if talib is not None:
+            # BBANDS uses the population std; rescale the width to the sample std
+            width = std * np.sqrt(period / (period - 1))
+            upper_band, ma, lower_band = talib.BBANDS(close.astype(np.float64), timeperiod=period,
+                                                      nbdevup=width, nbdevdn=width, matype=0)
+        else:
+            rolling = pd.Series(close, dtype=np.float64).rolling(window=period)
+            ma = rolling.mean().to_numpy()
+            std_dev = rolling.std().to_numpy()
+            upper_band = ma + (std_dev * std)
+            lower_band = ma - (std_dev * std)
+        return ma.astype(DTYPE), upper_band.astype(DTYPE), lower_band.astype(DTYPE)
 
     @staticmethod
     def calculate_bollinger_bands(df: pd.DataFrame, period: int = 20, std: int = 2) -> Tuple[float, float, float]:
         """Calculate Bollinger Bands"""
-        ma = df['close'].rolling(window=period).mean()
-        std_dev = df['close'].rolling(window=period).std()
-        upper_band = ma + (std_dev * std)
-        lower_band = ma - (std_dev * std)
-        return ma.iloc[-1], upper_band.iloc[-1], lower_band.iloc[-1]
+        ma, upper_band, lower_band = TechnicalIndicators.calculate_bollinger_bands_arrays(
+            df['close'].to_numpy(), period, std
+        )
+        return ma[-1], upper_band[-1], lower_band[-1]
+
+    @staticmethod
+    def calculate_all_arrays(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                             kdj_period: int = 9, rsi_period: int = 14, bb_period: int = 20,
+                             bb_std: int = 2) -> Tuple[np.ndarray, ...]:
+        """
+        Calculate K, D, trend strength, RSI, MA, upper and lower Bollinger Band
+        arrays in one fused pass over the data
+        """
+        high = np.ascontiguousarray(high, dtype=DTYPE)
+        low = np.ascontiguousarray(low, dtype=DTYPE)
+        close = np.ascontiguousarray(close, dtype=DTYPE)
+        
+        out = np.empty((7, close.shape[0]), DTYPE)
+        _compute_all(high, low, close, kdj_period, rsi_period, bb_period, float(bb_std), *out)
+        return tuple(out)
 
     @staticmethod
     def calculate_volume_profile(df: pd.DataFrame, num_bins: int = 10) -> Dict[float, float]:
@@ -58,12 +301,26 @@ class TechnicalIndicators:
     @staticmethod
     def calculate_support_resistance(df: pd.DataFrame, lookback: int = 20, threshold: float = 0.02) -> Tuple[float, float]:
         """Calculate Dynamic Support and Resistance levels"""
-        highs = df['high'].rolling(window=lookback).max()
-        lows = df['low'].rolling(window=lookback).min()
+        # Full windows only, unless the history is shorter than one window
+        start = min(lookback, len(df)) - 1
+        highs = _rolling_max(np.ascontiguousarray(df['high'].to_numpy(), dtype=DTYPE), lookback)[start:]
+        lows = _rolling_min(np.ascontiguousarray(df['low'].to_numpy(), dtype=DTYPE), lookback)[start:]
         
-        # Find clusters of highs and lows
+        # Find clusters of highs and lows on a grid of threshold-sized price buckets
         price_range = df['close'].iloc[-1] * threshold
-        resistance = highs.value_counts().sort_index().iloc[-1]
-        support = lows.value_counts().sort_index().iloc[0]
+        resistance = TechnicalIndicators._densest_level(highs, price_range)
+        support = TechnicalIndicators._densest_level(lows, price_range)
         
         return support, resistance
+
+    @staticmethod
+    def _densest_level(levels: np.ndarray, grid: float) -> float:
+        """Price of the grid bucket that the most levels round into, NaN if there are none"""
+        # Windows over gaps give NaN levels, which value_counts used to skip
+        levels = levels[np.isfinite(levels)]
+        if levels.size == 0:
+            return np.nan
+        buckets = np.round(levels / grid).astype(np.int64)
+        lowest = buckets.min()
+        counts = np.bincount(buckets - lowest)
+        return float((counts.argmax() + lowest) * grid)
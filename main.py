@@ -1,13 +1,52 @@
+from binance import ThreadedWebsocketManager
 from binance.client import Client
-from utils import get_timestamp_with_offset
+from utils import get_timestamp_with_offset, setup_logger
 from config import Config
-from indicators import TechnicalIndicators
+from indicators import TechnicalIndicators, DTYPE
 from backtester import Backtester
+from _njit import njit
 import pandas as pd
+import numpy as np
 from datetime import datetime
+import logging
+import math
+from decimal import Decimal
 import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
 from binance.enums import *
-from binance.exceptions import BinanceAPIException
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Handlers are installed by setup_logger() when the bot actually runs
+logger = logging.getLogger('trading_bot')
+
+# Worker threads for REST calls that can overlap with local computation
+_POOL = ThreadPoolExecutor(max_workers=2)
+
+# (step_size, precision) of the LOT_SIZE filter per symbol, fetched once per run
+_SYMBOL_META: Dict[str, Tuple[Optional[float], int]] = {}
+
+def _handle_response_orjson(response):
+    """Client._handle_response, parsing the body with orjson instead of stdlib json"""
+    if not (200 <= response.status_code < 300):
+        raise BinanceAPIException(response, response.status_code, response.text)
+    
+    if not response.content:
+        return {}
+    
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        raise BinanceRequestException("Invalid Response: %s" % response.text)
+
+if orjson is not None:
+    Client._handle_response = staticmethod(_handle_response_orjson)
 
 def format_server_time(timestamp_ms):
     """Convert millisecond timestamp to human readable format"""
@@ -39,9 +78,25 @@ def initialize_client():
         print(f"Error initializing client: {e}")
         raise
 
+def _klines_to_arrays(klines: list) -> SimpleNamespace:
+    """Parse raw kline rows into OHLCV NumPy arrays (timestamp in ms, prices as DTYPE)"""
+    n = len(klines)
+    timestamp = np.empty(n, np.int64)
+    o, h, l, c, v = (np.empty(n, DTYPE) for _ in range(5))
+    
+    for i, row in enumerate(klines):
+        timestamp[i] = row[0]
+        o[i] = float(row[1])
+        h[i] = float(row[2])
+        l[i] = float(row[3])
+        c[i] = float(row[4])
+        v[i] = float(row[5])
+    
+    return SimpleNamespace(timestamp=timestamp, open=o, high=h, low=l, close=c, volume=v)
+
 def get_historical_data(client: Client, symbol: str, interval: str, 
-                       start_str: str, end_str: str = None) -> pd.DataFrame:
-    """Fetch historical data from Binance Spot market"""
+                       start_str: str, end_str: str = None) -> SimpleNamespace:
+    """Fetch historical data from Binance Spot market as OHLCV arrays"""
     try:
         start_ts = int(pd.Timestamp(start_str).timestamp() * 1000)
         end_ts = int(pd.Timestamp(end_str).timestamp() * 1000) if end_str else int(time.time() * 1000)
@@ -55,21 +110,82 @@ def get_historical_data(client: Client, symbol: str, interval: str,
             limit=1000
         )
         
-        df = pd.DataFrame(klines, columns=[
-            'timestamp', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-            'taker_buy_quote', 'ignore'
-        ])
-        
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-        return df.set_index('timestamp')
+        return _klines_to_arrays(klines)
         
     except Exception as e:
         print(f"Error fetching historical data: {e}")
-        return pd.DataFrame()
+        return _klines_to_arrays([])
+
+class KlineBuffer:
+    """Ring buffer holding the most recent OHLCV klines as NumPy arrays"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        # Each bar is written twice, size slots apart, so the latest window is always contiguous
+        self._data = np.empty((5, 2 * size), DTYPE)
+        self._head = 0
+        self.count = 0
+        self.last_open_time = None
+    
+    def update(self, open_time: int, o: float, h: float, l: float, c: float, v: float):
+        """Append a kline, or overwrite the last one if it is the same (still forming) bar"""
+        if self.last_open_time is not None and open_time < self.last_open_time:
+            return
+        if open_time != self.last_open_time:
+            self._head = (self._head + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+            self.last_open_time = open_time
+        
+        slot = (self._head - 1) % self.size
+        self._data[:, slot] = self._data[:, slot + self.size] = (o, h, l, c, v)
+    
+    def extend(self, klines: list):
+        """Add raw kline rows as returned by the Binance REST API"""
+        for row in klines:
+            self.update(int(row[0]), float(row[1]), float(row[2]), float(row[3]),
+                        float(row[4]), float(row[5]))
+    
+    def window(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Get contiguous DTYPE (open, high, low, close, volume) views, oldest bar first"""
+        start = self._head + self.size - self.count
+        o, h, l, c, v = self._data[:, start:start + self.count]
+        return o, h, l, c, v
+
+# Signal actions as returned by _signal_core
+NEUTRAL, BUY, SELL = 0, 1, 2
+_ACTIONS = ('NEUTRAL', 'BUY', 'SELL')
+_REASONS = (
+    '',
+    'Bullish KDJ crossover with oversold RSI',
+    'Bearish KDJ crossover with overbought RSI'
+)
+
+@njit(cache=True)
+def _signal_core(k: float, d: float, rsi: float, current_price: float,
+                 ma: float, upper_bb: float, lower_bb: float, trend_strength: float,
+                 min_trend_strength: float, rsi_buy_thr: float = 70.0,
+                 rsi_sell_thr: float = 30.0) -> Tuple[int, float]:
+    """Scalar signal logic, returning (action, confidence)"""
+    # Strong trend condition
+    if trend_strength < min_trend_strength:
+        return NEUTRAL, 0.0
+    
+    # Buy Conditions
+    if (k > d and  # KDJ bullish crossover
+        rsi < rsi_buy_thr and  # Not overbought
+        current_price < lower_bb and  # Price below lower BB
+        current_price < ma):  # Price below MA
+        return BUY, min((rsi_buy_thr - rsi) / 30 * trend_strength, 1.0)
+    
+    # Sell Conditions
+    if (k < d and  # KDJ bearish crossover
+        rsi > rsi_sell_thr and  # Not oversold
+        current_price > upper_bb and  # Price above upper BB
+        current_price > ma):  # Price above MA
+        return SELL, min((rsi - rsi_sell_thr) / 30 * trend_strength, 1.0)
+    
+    return NEUTRAL, 0.0
+
 def generate_trading_signal(k: float, d: float, rsi: float, 
                           current_price: float, ma: float, 
                           upper_bb: float, lower_bb: float,
@@ -78,37 +194,19 @@ def generate_trading_signal(k: float, d: float, rsi: float,
     Generate trading signals based on technical indicators
     Strategy combines KDJ crossover, RSI, and Bollinger Bands
     """
-    signal = {
-        'action': 'NEUTRAL',
-        'confidence': 0,
-        'reason': ''
-    }
+    action, confidence = _signal_core(
+        float(k), float(d), float(rsi), float(current_price), float(ma),
+        float(upper_bb), float(lower_bb), float(trend_strength),
+        float(Config.MIN_TREND_STRENGTH)
+    )
+    if action == NEUTRAL:
+        return {'action': 'NEUTRAL', 'confidence': 0, 'reason': ''}
     
-    # Strong trend condition
-    if trend_strength < Config.MIN_TREND_STRENGTH:
-        return signal
-    
-    # Buy Conditions
-    if (k > d and  # KDJ bullish crossover
-        rsi < 70 and  # Not overbought
-        current_price < lower_bb and  # Price below lower BB
-        current_price < ma):  # Price below MA
-        
-        signal['action'] = 'BUY'
-        signal['confidence'] = min((70 - rsi) / 30 * trend_strength, 1)
-        signal['reason'] = 'Bullish KDJ crossover with oversold RSI'
-        
-    # Sell Conditions    
-    elif (k < d and  # KDJ bearish crossover
-          rsi > 30 and  # Not oversold
-          current_price > upper_bb and  # Price above upper BB
-          current_price > ma):  # Price above MA
-          
-        signal['action'] = 'SELL'
-        signal['confidence'] = min((rsi - 30) / 30 * trend_strength, 1)
-        signal['reason'] = 'Bearish KDJ crossover with overbought RSI'
-        
-    return signal
+    return {
+        'action': _ACTIONS[action],
+        'confidence': confidence,
+        'reason': _REASONS[action]
+    }
 
 def calculate_position_size(balance: float, current_price: float, 
                           signal_confidence: float) -> float:
@@ -185,6 +283,7 @@ def place_trade(client: Client, signal: dict, current_price: float,
             return {
                 'entry_order': order,
                 'stop_loss': stop_loss_order,
+                'stop_price': stop_loss,
                 'take_profit': take_profit
             }
             
@@ -192,22 +291,32 @@ def place_trade(client: Client, signal: dict, current_price: float,
         print(f"Error placing trade: {e}")
         return None
 
-def place_order(client: Client, symbol: str, side: str, quantity: float):
-    """Place spot market order"""
-    try:
-        # Get symbol info for precision
+def _get_step(client: Client, symbol: str) -> Tuple[Optional[float], int]:
+    """Get the LOT_SIZE step size and its decimal precision, cached per symbol"""
+    if symbol not in _SYMBOL_META:
         symbol_info = client.get_symbol_info(symbol)
-        step_size = None
+        step_size, precision = None, 0
         
         # Find the step size for quantity
         for f in symbol_info['filters']:
             if f['filterType'] == 'LOT_SIZE':
                 step_size = float(f['stepSize'])
+                # Decimals from the API string itself, so 0.5 or 0.00005 steps keep their digits
+                precision = max(0, -Decimal(f['stepSize']).normalize().as_tuple().exponent)
                 break
+        
+        _SYMBOL_META[symbol] = (step_size, precision)
+    return _SYMBOL_META[symbol]
+
+def place_order(client: Client, symbol: str, side: str, quantity: float):
+    """Place spot market order"""
+    try:
+        step_size, precision = _get_step(client, symbol)
                 
         # Round quantity to the correct precision
         if step_size:
-            quantity = round(quantity - (quantity % step_size), len(str(step_size).split('.')[1]))
+            # Small epsilon keeps exact multiples from flooring one step down
+            quantity = round(math.floor(quantity / step_size + 1e-9) * step_size, precision)
         
         order = client.create_order(
             symbol=symbol,
@@ -233,40 +342,48 @@ def get_current_price(client: Client, symbol: str) -> float:
         return None
 
 def run_live_trading():
-    """Run live spot trading strategy"""
+    """Run live spot trading strategy on closed bars from the kline websocket"""
+    setup_logger()
     try:
         client = initialize_client()
         print("Successfully connected to Binance Testnet (Spot)")
         
         indicators = TechnicalIndicators()
-        start_time = (datetime.now() - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        start_ts = int((datetime.now() - pd.Timedelta(days=1)).timestamp() * 1000)
+        
+        # Backfill once over REST, the kline stream keeps the buffer current afterwards
+        klines = KlineBuffer(Config.MAX_LOOKBACK)
+        klines.extend(client.get_historical_klines(
+            Config.SYMBOL, Config.TIMEFRAME, start_str=str(start_ts), limit=1000
+        ))
         
         active_position = False
         
-        while True:
+        def on_bar(msg: dict):
+            nonlocal active_position
+            if msg.get('e') != 'kline':
+                logger.error("Websocket error: %s", msg)
+                return
+            
+            bar = msg['k']
+            klines.update(int(bar['t']), float(bar['o']), float(bar['h']), float(bar['l']),
+                          float(bar['c']), float(bar['v']))
+            
+            # Only act once the bar has closed
+            if not bar['x']:
+                return
+            
             try:
-                # Get latest data
-                df = get_historical_data(
-                    client, 
-                    Config.SYMBOL, 
-                    Config.TIMEFRAME,
-                    start_str=start_time
-                )
-                
-                if df.empty:
-                    print("No data received, waiting...")
-                    time.sleep(10)
-                    continue
-                
-                # Get market data
-                balances = get_account_balance(client)
-                current_price = get_current_price(client, Config.SYMBOL)
-                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                # Get market data, fetching balances in the background while indicators run;
+                # they are only needed while a new position can still be opened
+                balances = None if active_position else _POOL.submit(get_account_balance, client)
+                current_price = float(bar['c'])
                 
                 # Calculate indicators
-                k, d, trend_strength = indicators.calculate_KDJ(df)
-                rsi = indicators.calculate_RSI(df)
-                ma, upper_bb, lower_bb = indicators.calculate_bollinger_bands(df)
+                _, high, low, close, _ = klines.window()
+                k, d, trend_strength, rsi, ma, upper_bb, lower_bb = (
+                    a[-1] for a in indicators.calculate_all_arrays(high, low, close)
+                )
                 
                 # Generate trading signal
                 signal = generate_trading_signal(
@@ -274,36 +391,45 @@ def run_live_trading():
                     upper_bb, lower_bb, trend_strength
                 )
                 
-                # Print market information
-                print(f"\nTime: {current_time}")
-                print(f"Price: ${current_price:,.2f}")
-                print(f"Signal: {signal['action']} (Confidence: {signal['confidence']:.2f})")
-                print(f"Reason: {signal['reason']}")
-                print("\nIndicators:")
-                print(f"KDJ - K: {k:.2f}, D: {d:.2f}")
-                print(f"RSI: {rsi:.2f}")
-                print(f"BB: {lower_bb:.2f} < {ma:.2f} < {upper_bb:.2f}")
+                # Log market information (timestamped by the handler, formatted only if INFO is enabled)
+                logger.info(
+                    "px=%.2f signal=%s conf=%.2f k=%.2f d=%.2f rsi=%.2f bb=%.2f<%.2f<%.2f %s",
+                    current_price, signal['action'], signal['confidence'], k, d, rsi,
+                    lower_bb, ma, upper_bb, signal['reason']
+                )
                 
                 # Execute trading logic
                 if not active_position and signal['action'] in ['BUY', 'SELL']:
-                    trade_result = place_trade(client, signal, current_price, balances)
+                    trade_result = place_trade(client, signal, current_price, balances.result())
                     if trade_result:
                         active_position = True
-                        print(f"\nExecuted {signal['action']} trade:")
-                        print(f"Entry Price: ${current_price:,.2f}")
-                        print(f"Stop Loss: ${trade_result['stop_loss']:,.2f}")
-                        print(f"Take Profit: ${trade_result['take_profit']:,.2f}")
-                
-                time.sleep(Config.INTERVAL)
+                        logger.info(
+                            "Executed %s trade: entry=%.2f stop=%.2f target=%.2f",
+                            signal['action'], current_price, trade_result['stop_price'],
+                            trade_result['take_profit']
+                        )
                 
             except Exception as e:
-                print(f"Error in trading loop: {e}")
-                time.sleep(Config.INTERVAL)
+                logger.error("Error in trading loop: %s", e)
+        
+        twm = ThreadedWebsocketManager(
+            api_key=Config.API_KEY,
+            api_secret=Config.API_SECRET,
+            testnet=True
+        )
+        twm.start()
+        twm.start_kline_socket(callback=on_bar, symbol=Config.SYMBOL, interval=Config.TIMEFRAME)
+        
+        try:
+            twm.join()
+        finally:
+            twm.stop()
                 
     except Exception as e:
         print(f"Critical error in trading: {e}")
 
 if __name__ == "__main__":
+    setup_logger()
     print("=== Crypto Spot Trading Bot (Testnet) ===")
     print("1. Run Live Trading")
     print("2. Show Current Price")
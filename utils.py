@@ -1,110 +1,399 @@
 # utils.py
+# Contract: drawdown series are float32, and an empty TradeBook() stores appended profits as
+# float32, which is plenty for summary statistics and halves memory traffic. Books built with
+# from_list/from_columns (records, backtests) keep their float64 profits, so those values are
+# never rounded. Sums, mean and std are accumulated in float64 over whatever is stored, which
+# keeps the variance free of cancellation but cannot undo an earlier float32 rounding.
 import pandas as pd
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
 import logging
+import queue
+import atexit
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 # In utils.py, add this import at the top
 import time
+from functools import lru_cache
+from _njit import njit
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('trading_bot.log'),
-        logging.StreamHandler()
-    ]
-)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = pacsv = None
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+# Trade side codes stored in TradeBook.side; index -1 picks 'short'
+_SIDE_NAMES = np.array([None, 'long', 'short'], dtype=object)
+_SIDE_CODES = {'long': 1, 'short': -1}
+
+def _to_ns(times: List, n: int) -> np.ndarray:
+    """Convert datetimes or pandas Timestamps (mixed freely) to int64 nanoseconds"""
+    try:
+        return np.fromiter((t.value for t in times), dtype=np.int64, count=n)
+    except AttributeError:
+        # Some entries are plain datetimes
+        return np.fromiter((pd.Timestamp(t).value for t in times), dtype=np.int64, count=n)
+
+class TradeBook:
+    """Closed trades stored column-wise; only the first len(book) entries are valid"""
+    __slots__ = ('side', 'entry_ns', 'exit_ns', 'entry_price', 'exit_price',
+                 'profit', 'balance_before', 'balance_after', 'tz', '_n', '_cap')
+    _ARRAYS = ('side', 'entry_ns', 'exit_ns', 'entry_price', 'exit_price',
+               'profit', 'balance_before', 'balance_after')
+
+    def __init__(self, capacity: int = 64, tz=None, profit_dtype=np.float32):
+        capacity = max(capacity, 1)
+        # entry_ns/exit_ns are UTC for tz-aware trades; tz restores their zone in to_frame
+        self.tz = tz
+        self.side = np.zeros(capacity, np.int8)
+        self.entry_ns = np.empty(capacity, np.int64)
+        self.exit_ns = np.empty(capacity, np.int64)
+        self.entry_price = np.full(capacity, np.nan)
+        self.exit_price = np.full(capacity, np.nan)
+        self.profit = np.empty(capacity, profit_dtype)
+        self.balance_before = np.full(capacity, np.nan)
+        self.balance_after = np.full(capacity, np.nan)
+        self._n = 0
+        self._cap = capacity
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _grow(self):
+        """Double the capacity of every column"""
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.full(2 * self._cap, np.nan, old.dtype) if old.dtype.kind == 'f' else np.zeros(2 * self._cap, old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+        self._cap *= 2
+
+    def append(self, side: str, entry_time, exit_time, profit: float,
+               entry_price: float = np.nan, exit_price: float = np.nan,
+               balance_before: float = np.nan, balance_after: float = np.nan):
+        """Add one closed trade; takes the same keys as a trade record"""
+        entry_time, exit_time = pd.Timestamp(entry_time), pd.Timestamp(exit_time)
+        # The first trade fixes the zone to_frame reports; aware times are stored as UTC
+        if self._n == 0 and self.tz is None:
+            self.tz = entry_time.tz
+        elif (entry_time.tz is None) != (self.tz is None):
+            raise ValueError("cannot mix tz-naive and tz-aware trade times in one TradeBook")
+        
+        if self._n == self._cap:
+            self._grow()
+        i = self._n
+        self.side[i] = _SIDE_CODES.get(side, 0)
+        self.entry_ns[i] = entry_time.value
+        self.exit_ns[i] = exit_time.value
+        self.profit[i] = profit
+        self.entry_price[i] = entry_price
+        self.exit_price[i] = exit_price
+        self.balance_before[i] = balance_before
+        self.balance_after[i] = balance_after
+        self._n += 1
+
+    @classmethod
+    def from_columns(cls, side: np.ndarray, entry_ns: np.ndarray, exit_ns: np.ndarray,
+                     profit: np.ndarray, tz=None, **prices_and_balances: np.ndarray) -> 'TradeBook':
+        """Build a book by copying trade columns, e.g. entry_price=..., balance_after=...; profit keeps its precision"""
+        profit = np.asarray(profit)
+        n = len(profit)
+        book = cls(n, tz, profit.dtype if profit.dtype.kind == 'f' else np.float64)
+        book.side[:n] = side
+        book.entry_ns[:n] = entry_ns
+        book.exit_ns[:n] = exit_ns
+        book.profit[:n] = profit
+        for name, values in prices_and_balances.items():
+            getattr(book, name)[:n] = values
+        book._n = n
+        return book
+
+    @classmethod
+    def from_list(cls, trades: List[Dict]) -> 'TradeBook':
+        """Build a book from trade records; missing prices and balances are left as NaN"""
+        n = len(trades)
+        optional = {}
+        for name in ('entry_price', 'exit_price', 'balance_before', 'balance_after'):
+            if n and name in trades[0]:
+                optional[name] = np.fromiter((t[name] for t in trades), dtype=np.float64, count=n)
+        return cls.from_columns(
+            np.fromiter((_SIDE_CODES.get(t.get('side'), 0) for t in trades), dtype=np.int8, count=n),
+            _to_ns([t['entry_time'] for t in trades], n),
+            _to_ns([t['exit_time'] for t in trades], n),
+            np.fromiter((t['profit'] for t in trades), dtype=np.float64, count=n),
+            tz=getattr(trades[0]['entry_time'], 'tzinfo', None) if n else None,
+            **optional
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Trades as a DataFrame with one row per trade"""
+        n = self._n
+        if self.tz is None:
+            entry_time, exit_time = pd.to_datetime(self.entry_ns[:n]), pd.to_datetime(self.exit_ns[:n])
+        else:
+            entry_time = pd.to_datetime(self.entry_ns[:n], utc=True).tz_convert(self.tz)
+            exit_time = pd.to_datetime(self.exit_ns[:n], utc=True).tz_convert(self.tz)
+        return pd.DataFrame({
+            'side': _SIDE_NAMES[self.side[:n]],
+            'entry_time': entry_time,
+            'exit_time': exit_time,
+            'entry_price': self.entry_price[:n],
+            'exit_price': self.exit_price[:n],
+            'profit': self.profit[:n].astype(np.float64),
+            'balance_before': self.balance_before[:n],
+            'balance_after': self.balance_after[:n]
+        })
+
+@njit(cache=True)
+def _trade_stats(profits: np.ndarray, durations: np.ndarray):
+    """
+    Single pass over non-empty trade arrays, returning (positive sum, negative sum,
+    winners, losers, smallest, largest, mean, population std, mean duration)
+    """
+    n = profits.shape[0]
+    pos_sum = neg_sum = 0.0
+    pos_count = neg_count = 0
+    smallest = largest = np.float64(profits[0])
+    mean = m2 = 0.0
+    duration_sum = 0.0
+    
+    for i in range(n):
+        p = np.float64(profits[i])
+        if p > 0:
+            pos_sum += p
+            pos_count += 1
+        elif p < 0:
+            neg_sum += p
+            neg_count += 1
+        if p < smallest:
+            smallest = p
+        if p > largest:
+            largest = p
+        
+        # Welford update keeps the variance stable without a second pass
+        delta = p - mean
+        mean += delta / (i + 1)
+        m2 += delta * (p - mean)
+        duration_sum += durations[i]
+    
+    return (pos_sum, neg_sum, pos_count, neg_count, smallest, largest,
+            mean, np.sqrt(m2 / n), duration_sum / n)
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler that lets the file buffer fill up and flushes it on a timer instead of per record"""
+
+    def __init__(self, filename: str, flush_interval: float = 1.0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='log-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            super().flush()
+
+    def flush(self):
+        """Skip the per-record flush; the flusher thread and close() write the buffer out"""
+
+    def close(self):
+        self._stop.set()
+        if self._flusher.is_alive() and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        super().flush()
+        super().close()
+
+# Background listener doing the file/console writes, started by setup_logger
+_log_listener: Optional[QueueListener] = None
 
 def setup_logger():
-    """Setup logger for the trading bot"""
+    """Setup logger for the trading bot; records are written by a background thread"""
+    global _log_listener
+    if _log_listener is None:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        file_handler = BufferedFileHandler('trading_bot.log')
+        stream_handler = logging.StreamHandler()
+        file_handler.setFormatter(formatter)
+        stream_handler.setFormatter(formatter)
+        
+        # Logging calls only enqueue the record; the listener does the I/O
+        log_queue = queue.SimpleQueue()
+        _log_listener = QueueListener(log_queue, file_handler, stream_handler,
+                                      respect_handler_level=True)
+        _log_listener.start()
+        # atexit runs in reverse: the listener drains the queue before the file is closed
+        atexit.register(file_handler.close)
+        atexit.register(_log_listener.stop)
+        
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.handlers = [QueueHandler(log_queue)]
     return logging.getLogger('trading_bot')
 
-def calculate_trade_metrics(trades: List[Dict]) -> Dict:
+def calculate_trade_metrics(trades: Union[TradeBook, List[Dict]]) -> Dict:
     """Calculate comprehensive trade metrics"""
-    if not trades:
+    book = trades if isinstance(trades, TradeBook) else TradeBook.from_list(trades)
+    n = len(book)
+    if not n:
         return {}
 
-    profits = [trade['profit'] for trade in trades]
-    durations = [(trade['exit_time'] - trade['entry_time']).total_seconds()/3600 
-                 for trade in trades]
+    profits = book.profit[:n]
+    durations = (book.exit_ns[:n] - book.entry_ns[:n]).astype(np.float64) * (1.0 / 3.6e12)
+
+    (pos_sum, neg_sum, winning, losing, largest_loss, largest_win,
+     mean, std, average_duration) = _trade_stats(profits, durations)
+    
+    # Median from one O(n) partition around the middle element(s)
+    half = n // 2
+    if n % 2:
+        median = np.float64(np.partition(profits, half)[half])
+    else:
+        middle = np.partition(profits, (half - 1, half))
+        median = (np.float64(middle[half - 1]) + middle[half]) / 2
 
     metrics = {
-        'total_trades': len(trades),
-        'winning_trades': len([p for p in profits if p > 0]),
-        'losing_trades': len([p for p in profits if p < 0]),
-        'win_rate': len([p for p in profits if p > 0]) / len(trades),
-        'average_profit': np.mean(profits),
-        'median_profit': np.median(profits),
-        'largest_win': max(profits),
-        'largest_loss': min(profits),
-        'average_duration': np.mean(durations),
-        'profit_factor': abs(sum([p for p in profits if p > 0]) / 
-                           sum([p for p in profits if p < 0])) if sum([p for p in profits if p < 0]) != 0 else float('inf'),
-        'expectancy': np.mean(profits) / np.std(profits) if len(profits) > 1 else 0
+        'total_trades': n,
+        'winning_trades': winning,
+        'losing_trades': losing,
+        'win_rate': winning / n,
+        'average_profit': mean,
+        'median_profit': median,
+        'largest_win': largest_win,
+        'largest_loss': largest_loss,
+        'average_duration': average_duration,
+        'profit_factor': abs(pos_sum / neg_sum) if neg_sum != 0 else float('inf'),
+        'expectancy': np.divide(mean, std) if n > 1 else 0
     }
     
     return metrics
 def get_timestamp_with_offset(offset: int) -> int:
     """Get current timestamp with server offset applied"""
-    return int(time.time() * 1000) + offset
+    return time.time_ns() // 1_000_000 + offset
+
+@lru_cache(maxsize=32)
+def _fmt(decimals: int):
+    """Bound str.format for a fixed number of decimal places"""
+    return ("{:.%df}" % decimals).format
 
 def format_number(number: float, decimals: int = 8) -> str:
     """Format number with appropriate decimal places"""
-    return f"{number:.{decimals}f}"
-
-def calculate_risk_reward_ratio(entry_price: float, stop_loss: float, 
-                              take_profit: float, side: str) -> float:
-    """Calculate risk/reward ratio for a trade"""
-    if side == 'long':
-        risk = entry_price - stop_loss
-        reward = take_profit - entry_price
-    else:
-        risk = stop_loss - entry_price
-        reward = entry_price - take_profit
+    return _fmt(decimals)(number)
+
+def calculate_risk_reward_ratio(entry_price: Union[float, np.ndarray], stop_loss: Union[float, np.ndarray],
+                              take_profit: Union[float, np.ndarray],
+                              side: Union[str, np.ndarray]) -> Union[float, np.ndarray]:
+    """
+    Calculate risk/reward ratio for a trade, or element-wise for arrays of trades.
+    side is 'long'/'short' (scalar or array) or a boolean array that is True for longs
+    """
+    entry = np.asarray(entry_price, dtype=np.float64)
+    sl = np.asarray(stop_loss, dtype=np.float64)
+    tp = np.asarray(take_profit, dtype=np.float64)
+    side = np.asarray(side)
+    long_mask = side if side.dtype == np.bool_ else side == 'long'
+    
+    risk = np.where(long_mask, entry - sl, sl - entry)
+    reward = np.where(long_mask, tp - entry, entry - tp)
+    ratio = np.divide(reward, risk, out=np.zeros_like(reward), where=risk != 0)
     
-    return reward / risk if risk != 0 else 0
+    # Scalar inputs give a 0-d result; hand back a plain float
+    return float(ratio) if ratio.ndim == 0 else ratio
 
 def validate_price_data(df: pd.DataFrame) -> bool:
     """Validate price data for integrity"""
     # Check for required columns
     required_columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
-    if not all(col in df.columns for col in required_columns):
+    if not set(df.columns).issuperset(required_columns):
         return False
     
-    # Check for missing values
-    if df[required_columns].isnull().any().any():
+    # Check for missing values on the raw buffers; timestamp may be datetime64 or numeric
+    prices = df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype=np.float64, copy=False)
+    if pd.isna(df['timestamp'].to_numpy()).any() or np.isnan(prices).any():
         return False
     
-    # Check for logical price relationships
-    price_valid = (df['high'] >= df['low']).all() and \
-                 (df['high'] >= df['close']).all() and \
-                 (df['high'] >= df['open']).all() and \
-                 (df['low'] <= df['close']).all() and \
-                 (df['low'] <= df['open']).all()
+    # Check for logical price relationships in one fused pass
+    o, h, l, c = prices[:, 0], prices[:, 1], prices[:, 2], prices[:, 3]
+    if ne is not None:
+        price_valid = ne.evaluate('(h >= l) & (h >= c) & (h >= o) & (l <= c) & (l <= o)')
+    else:
+        price_valid = (h >= l) & (h >= c) & (h >= o) & (l <= c) & (l <= o)
     
-    return price_valid
+    return bool(price_valid.all())
+
+@njit(cache=True)
+def _dd(equity: np.ndarray, peak: float, out: np.ndarray):
+    """Drawdown of each point from the running peak, seeded with peak; NaN points are skipped"""
+    for i in range(equity.shape[0]):
+        x = equity[i]
+        peak = x if x > peak else peak
+        out[i] = x / peak - 1.0
 
-def calculate_drawdown(equity_curve: pd.Series) -> pd.Series:
-    """Calculate drawdown series"""
-    rolling_max = equity_curve.expanding(min_periods=1).max()
-    drawdown = equity_curve / rolling_max - 1
-    return drawdown
+def calculate_drawdown(equity_curve: pd.Series, starting_value: Optional[float] = None) -> pd.Series:
+    """
+    Calculate drawdown series.
+    Pass the starting capital (or 1.0 for normalized curves) as starting_value
+    so that a loss on the first point counts as drawdown
+    """
+    equity = equity_curve.to_numpy(dtype=np.float32, copy=False)
+    drawdown = np.empty_like(equity)
+    # -inf leaves the first point as its own peak
+    _dd(equity, -np.inf if starting_value is None else float(starting_value), drawdown)
+    return pd.Series(drawdown, index=equity_curve.index)
 
-def save_trade_history(trades: List[Dict], filename: str = 'trade_history.csv'):
-    """Save trade history to CSV file"""
-    if not trades:
+def save_trade_history(trades: Union[TradeBook, List[Dict]], filename: str = 'trade_history.parquet'):
+    """Save trade history to a Parquet or CSV file, chosen by suffix"""
+    if not len(trades):
         return
         
-    df = pd.DataFrame(trades)
-    df.to_csv(filename, index=False)
+    # Records keep whatever keys and types the caller gave them
+    df = trades.to_frame() if isinstance(trades, TradeBook) else pd.DataFrame(trades)
+    if filename.endswith('.parquet'):
+        try:
+            df.to_parquet(filename, engine='auto', compression='zstd', index=False)
+            logging.info(f"Trade history saved to {filename}")
+            return
+        except ImportError:
+            # No Parquet engine installed; keep the history as CSV alongside instead
+            filename = filename[:-len('.parquet')] + '.csv'
+            logging.warning(f"No Parquet engine available, saving trade history to {filename}")
+    
+    if pacsv is not None:
+        try:
+            pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), filename)
+        except pa.ArrowException:
+            # Mixed-type or nested columns that Arrow cannot represent go through pandas
+            df.to_csv(filename, index=False)
+    else:
+        df.to_csv(filename, index=False)
     logging.info(f"Trade history saved to {filename}")
 
-def load_trade_history(filename: str = 'trade_history.csv') -> List[Dict]:
-    """Load trade history from CSV file"""
+def load_trade_history(filename: str = 'trade_history.parquet') -> List[Dict]:
+    """Load trade history from a Parquet or CSV file, chosen by suffix"""
     try:
-        df = pd.DataFrame(filename)
+        if filename.endswith('.parquet'):
+            try:
+                # Parquet keeps column types, timestamps included
+                return pd.read_parquet(filename, engine='auto').to_dict('records')
+            except ImportError:
+                # No Parquet engine; save_trade_history wrote the CSV sibling instead
+                filename = filename[:-len('.parquet')] + '.csv'
+        
+        try:
+            df = pd.read_csv(filename, engine='pyarrow')
+        except ImportError:
+            df = pd.read_csv(filename)
+        
+        # Restore trade timestamps so metrics get real datetimes
+        for col in ('entry_time', 'exit_time'):
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col])
         return df.to_dict('records')
     except Exception as e:
         logging.error(f"Error loading trade history: {e}")